@@ -1,20 +1,45 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g
+from functools import wraps
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_caching import Cache
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+from sqlalchemy import case, event, func, inspect, text
+from sqlalchemy.orm import joinedload
 from models import db, User, ParkingLot, ParkingSpot, ParkingReservation
 from datetime import datetime
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
 # Database configuration - using SQLite for simplicity
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///parking.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,      # drop stale connections instead of 500ing
+    'pool_size': 20,
+    'max_overflow': 40,
+    'pool_recycle': 1800,
+    'connect_args': {'check_same_thread': False},  # SQLite + threaded server
+}
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Compiled templates are cached to disk across restarts, and we don't
+# stat template files on every render looking for edits
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+app.jinja_env.auto_reload = False
+
 # Set up our extensions
 db.init_app(app)
+Compress(app)  # gzip/brotli for the dashboard HTML
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
@@ -25,17 +50,85 @@ def load_user(user_id):
     """Load a user by their ID for Flask-Login"""
     return User.query.get(int(user_id))
 
+# Argon2id is deliberately memory-hard, so offline cracking rigs can't
+# use GPUs effectively. These parameters target ~50ms per hash.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
+def hash_password(password):
+    """Hash a password with argon2id for storage"""
+    return password_hasher.hash(password)
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash.
+
+    Accounts created before the switch to argon2 still have werkzeug
+    pbkdf2 hashes, so fall back to those when the hash isn't argon2.
+    """
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except VerifyMismatchError:
+        return False
+    except InvalidHashError:
+        return check_password_hash(stored_hash, password)
+
+# Hash we verify against when the username doesn't exist, so a failed
+# login takes the same time whether or not the account is real
+DUMMY_PASSWORD_HASH = hash_password('not-a-real-password')
+
+def create_default_admin():
+    """Create the default admin account if no admin exists yet"""
+    if User.query.filter_by(role='admin').first():
+        return False
+    admin_user = User(username='admin', password=hash_password('admin123'), role='admin')
+    db.session.add(admin_user)
+    db.session.commit()
+    return True
+
 # Initialize the database and create a default admin user
 with app.app_context():
+    # Put SQLite in WAL mode so dashboard reads don't block on bookings;
+    # runs for every new connection the pool opens
+    @event.listens_for(db.engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    # Only a brand-new database needs the default admin seeded; skipping
+    # the lookup otherwise saves a boot-time query in every worker
+    fresh_database = not inspect(db.engine).has_table('user')
     db.create_all()
-    
-    # Check if we need to create an admin user
-    if not User.query.filter_by(role='admin').first():
-        admin_password = generate_password_hash('admin123', method='pbkdf2:sha256')
-        admin_user = User(username='admin', password=admin_password, role='admin')
-        db.session.add(admin_user)
-        db.session.commit()
+
+    if fresh_database and create_default_admin():
+        print("Created default admin user: username='admin', password='admin123'")
+
+@app.cli.command('init-admin')
+def init_admin_command():
+    """Seed the default admin account into an existing database"""
+    if create_default_admin():
         print("Created default admin user: username='admin', password='admin123'")
+    else:
+        print("An admin account already exists - nothing to do.")
+
+def admin_required(view):
+    """Only let admins through; everyone else goes to the user dashboard.
+
+    The role is resolved from current_user once per request and cached
+    on flask.g, so a view (or anything else in the request) asking again
+    doesn't re-resolve the login proxy.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        role = getattr(g, 'role', None)
+        if role is None:
+            role = current_user.role
+            g.role = role
+        if role != 'admin':
+            flash('Sorry, you need admin privileges to access that page.', 'error')
+            return redirect(url_for('user_dashboard'))
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route('/')
 def index():
@@ -69,7 +162,7 @@ def register():
             return render_template('register.html')
         
         # Create the new user
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+        hashed_password = hash_password(password)
         new_user = User(username=username, password=hashed_password, role='user')
         
         try:
@@ -95,10 +188,15 @@ def login():
             flash('Please enter both username and password.', 'error')
             return render_template('login.html')
         
-        # Find the user and check their password
+        # Find the user and check their password. Always run the hash
+        # check (against a dummy hash for unknown usernames) so response
+        # timing doesn't reveal which usernames exist.
         user = User.query.filter_by(username=username).first()
-        
-        if not user or not check_password_hash(user.password, password):
+        password_ok = verify_password(
+            user.password if user else DUMMY_PASSWORD_HASH, password
+        )
+
+        if not user or not password_ok:
             flash('Invalid login credentials. Please try again.', 'error')
             return render_template('login.html')
         
@@ -121,30 +219,47 @@ def logout():
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('login'))
 
+@cache.memoize(timeout=30)
+def get_admin_stats():
+    """Gather the system-wide dashboard statistics.
+
+    The numbers only change when spots are booked/released or lots are
+    created/deleted, so the result is memoized and those views
+    invalidate it explicitly.
+    """
+    # One query gives us both spot counts instead of two separate scans
+    total_spots, occupied_spots = db.session.query(
+        func.count(ParkingSpot.id),
+        func.coalesce(func.sum(case((ParkingSpot.status == ParkingSpot.OCCUPIED, 1), else_=0)), 0)
+    ).one()
+    total_users = User.query.filter_by(role='user').count()
+
+    # Let the database total up the earnings from completed bookings
+    # rather than fetching every reservation row just to sum one column
+    total_earnings = db.session.query(
+        func.coalesce(func.sum(ParkingReservation.total_cost), 0)
+    ).filter(ParkingReservation.leaving_timestamp.isnot(None)).scalar()
+
+    return total_spots, occupied_spots, total_users, total_earnings
+
 @app.route('/admin_dashboard')
 @login_required
+@admin_required
 def admin_dashboard():
     """Admin dashboard with overview of the parking system"""
-    # Make sure only admins can access this
-    if current_user.role != 'admin':
-        flash('Sorry, you need admin privileges to access that page.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     # Gather all the statistics we need
     parking_lots = ParkingLot.query.all()
-    total_spots = ParkingSpot.query.count()
-    occupied_spots = ParkingSpot.query.filter_by(status='O').count()
+    total_spots, occupied_spots, total_users, total_earnings = get_admin_stats()
     available_spots = total_spots - occupied_spots
-    total_users = User.query.filter_by(role='user').count()
     
-    # Calculate total earnings from completed bookings
-    completed_reservations = ParkingReservation.query.filter(
-        ParkingReservation.leaving_timestamp.isnot(None)
-    ).all()
-    total_earnings = sum(reservation.total_cost or 0 for reservation in completed_reservations)
-    
-    # Get recent bookings for the dashboard
-    recent_bookings = ParkingReservation.query.filter(
+    # Get recent bookings for the dashboard, eager loading the spot, lot
+    # and user the template renders (just the username for users - no
+    # point dragging password hashes along) so each row doesn't trigger
+    # its own lazy SELECTs
+    recent_bookings = ParkingReservation.query.options(
+        joinedload(ParkingReservation.spot).joinedload(ParkingSpot.lot),
+        joinedload(ParkingReservation.user).load_only(User.username)
+    ).filter(
         ParkingReservation.leaving_timestamp.isnot(None)
     ).order_by(ParkingReservation.leaving_timestamp.desc()).limit(10).all()
     
@@ -159,13 +274,9 @@ def admin_dashboard():
 
 @app.route('/admin/create_lot', methods=['GET', 'POST'])
 @login_required
+@admin_required
 def create_parking_lot():
     """Create a new parking lot"""
-    # Admin only feature
-    if current_user.role != 'admin':
-        flash('Only administrators can create parking lots.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     if request.method == 'POST':
         # Get all the form data
         name = request.form.get('prime_location_name', '').strip()
@@ -195,23 +306,29 @@ def create_parking_lot():
             price=price,
             address=address,
             pin_code=pin_code,
-            maximum_number_of_spots=max_spots
+            maximum_number_of_spots=max_spots,
+            available_count=max_spots
         )
         
         try:
             db.session.add(new_lot)
             db.session.flush()  # This gets us the ID we need
-            
-            # Now create all the parking spots for this lot
-            for spot_number in range(1, max_spots + 1):
-                spot = ParkingSpot(
-                    lot_id=new_lot.id,
-                    spot_number=f"{new_lot.prime_location_name[:3].upper()}-{spot_number:03d}",
-                    status='A'  # A = Available
-                )
-                db.session.add(spot)
-            
+
+            # Now create all the parking spots for this lot in one bulk insert
+            # instead of adding them to the session one at a time
+            prefix = new_lot.prime_location_name[:3].upper()
+            spot_rows = [
+                {
+                    'lot_id': new_lot.id,
+                    'spot_number': f"{prefix}-{spot_number:03d}",
+                    'status': ParkingSpot.AVAILABLE
+                }
+                for spot_number in range(1, max_spots + 1)
+            ]
+            db.session.bulk_insert_mappings(ParkingSpot, spot_rows)
+
             db.session.commit()
+            cache.delete_memoized(get_admin_stats)
             flash(f'Successfully created "{name}" with {max_spots} parking spots!', 'success')
             return redirect(url_for('admin_dashboard'))
             
@@ -223,12 +340,9 @@ def create_parking_lot():
 
 @app.route('/admin/edit_lot/<int:lot_id>', methods=['GET', 'POST'])
 @login_required
+@admin_required
 def edit_parking_lot(lot_id):
     """Edit an existing parking lot"""
-    if current_user.role != 'admin':
-        flash('Only administrators can edit parking lots.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     lot = ParkingLot.query.get_or_404(lot_id)
     
     if request.method == 'POST':
@@ -250,16 +364,13 @@ def edit_parking_lot(lot_id):
 
 @app.route('/admin/delete_lot/<int:lot_id>')
 @login_required
+@admin_required
 def delete_parking_lot(lot_id):
     """Delete a parking lot (only if no spots are occupied)"""
-    if current_user.role != 'admin':
-        flash('Only administrators can delete parking lots.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     lot = ParkingLot.query.get_or_404(lot_id)
     
     # Safety check - don't delete if people are parked there
-    occupied_spots = ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count()
+    occupied_spots = ParkingSpot.query.filter_by(lot_id=lot_id, status=ParkingSpot.OCCUPIED).count()
     if occupied_spots > 0:
         flash(f'Cannot delete this parking lot - {occupied_spots} spots are currently occupied.', 'error')
         return redirect(url_for('admin_dashboard'))
@@ -267,6 +378,7 @@ def delete_parking_lot(lot_id):
     try:
         db.session.delete(lot)
         db.session.commit()
+        cache.delete_memoized(get_admin_stats)
         flash(f'Successfully deleted "{lot.prime_location_name}".', 'success')
     except Exception as e:
         db.session.rollback()
@@ -276,16 +388,27 @@ def delete_parking_lot(lot_id):
 
 @app.route('/admin/view_lot/<int:lot_id>')
 @login_required
+@admin_required
 def view_parking_lot(lot_id):
     """View detailed information about a specific parking lot"""
-    if current_user.role != 'admin':
-        flash('Only administrators can view detailed parking lot information.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     lot = ParkingLot.query.get_or_404(lot_id)
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
-    
-    return render_template('view_lot.html', lot=lot, spots=spots)
+    spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.id).all()
+
+    # Fetch every active reservation for this lot (with its user) in one
+    # query and hand the template a spot_id lookup, so rendering the
+    # spot grid doesn't query per occupied spot
+    active_reservations = {
+        reservation.spot_id: reservation
+        for reservation in ParkingReservation.query.options(
+            joinedload(ParkingReservation.user).load_only(User.username)
+        ).join(ParkingSpot).filter(
+            ParkingSpot.lot_id == lot_id,
+            ParkingReservation.leaving_timestamp.is_(None)
+        ).all()
+    }
+
+    return render_template('view_lot.html', lot=lot, spots=spots,
+                           active_reservations=active_reservations)
 
 @app.route('/user_dashboard')
 @login_required
@@ -295,28 +418,31 @@ def user_dashboard():
     if current_user.role != 'user':
         return redirect(url_for('admin_dashboard'))
     
-    # Get all available parking lots
+    # Get all available parking lots, with spot availability for every
+    # lot computed in one grouped query instead of one query per lot
     parking_lots = ParkingLot.query.all()
-    
+    available_counts = ParkingLot.available_spot_counts()
+    full_lots = [lot for lot in parking_lots if available_counts.get(lot.id, 0) == 0]
+
     # Check if user has an active parking reservation
     current_reservation = ParkingReservation.query.filter_by(
         user_id=current_user.id, 
         leaving_timestamp=None
     ).first()
     
-    # Calculate how long they've been parked (if they are currently parked)
-    current_duration = None
-    if current_reservation:
-        time_parked = datetime.utcnow() - current_reservation.parking_timestamp
-        current_duration = time_parked.total_seconds() / 3600  # Convert to hours
+    # How long they've been parked (if they are currently parked) -
+    # duration_hours uses the per-request timestamp from models
+    current_duration = current_reservation.duration_hours if current_reservation else None
     
     # Get their parking history
     history = ParkingReservation.query.filter_by(user_id=current_user.id).order_by(
         ParkingReservation.parking_timestamp.desc()
     ).limit(10).all()
     
-    return render_template('user_dashboard.html', 
+    return render_template('user_dashboard.html',
                          parking_lots=parking_lots,
+                         available_counts=available_counts,
+                         full_lots=full_lots,
                          current_reservation=current_reservation,
                          current_duration=current_duration,
                          history=history)
@@ -330,13 +456,16 @@ def book_spot(lot_id):
         flash('Only regular users can book parking spots.', 'error')
         return redirect(url_for('admin_dashboard'))
     
-    # Make sure they don't already have a spot
-    existing_reservation = ParkingReservation.query.filter_by(
-        user_id=current_user.id, 
-        leaving_timestamp=None
-    ).first()
-    
-    if existing_reservation:
+    # Make sure they don't already have a spot - a bare EXISTS check,
+    # since we don't need any of the reservation's columns here
+    has_active_reservation = db.session.query(
+        db.session.query(ParkingReservation.id).filter_by(
+            user_id=current_user.id,
+            leaving_timestamp=None
+        ).exists()
+    ).scalar()
+
+    if has_active_reservation:
         flash('You already have an active parking reservation. Please release it first.', 'warning')
         return redirect(url_for('user_dashboard'))
     
@@ -346,31 +475,47 @@ def book_spot(lot_id):
         flash('Sorry, that parking lot could not be found.', 'error')
         return redirect(url_for('user_dashboard'))
     
-    # Find the first available spot
-    available_spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').first()
-    
-    if not available_spot:
-        flash('Sorry, no spots are available in this parking lot right now.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     try:
-        # Create the reservation
+        # Claim the first available spot with a single conditional UPDATE.
+        # Doing the find-and-occupy in one statement means two users can't
+        # grab the same spot between a SELECT and a separate UPDATE.
+        claimed_spot = db.session.execute(
+            text(
+                "UPDATE parking_spot SET status = :occupied "
+                "WHERE id = (SELECT id FROM parking_spot "
+                "WHERE lot_id = :lot_id AND status = :available LIMIT 1) "
+                "RETURNING id, spot_number"
+            ),
+            {'lot_id': lot_id,
+             'occupied': ParkingSpot.OCCUPIED,
+             'available': ParkingSpot.AVAILABLE}
+        ).first()
+
+        if not claimed_spot:
+            db.session.rollback()
+            flash('Sorry, no spots are available in this parking lot right now.', 'error')
+            return redirect(url_for('user_dashboard'))
+
+        # Keep the lot's denormalized availability counter in step
+        ParkingLot.query.filter_by(id=lot_id).update(
+            {'available_count': ParkingLot.available_count - 1}
+        )
+
+        # Create the reservation for the spot we just claimed
         reservation = ParkingReservation(
-            spot_id=available_spot.id,
+            spot_id=claimed_spot.id,
             user_id=current_user.id,
             parking_cost_per_unit_time=lot.price
         )
-        
-        # Mark the spot as occupied
-        available_spot.status = 'O'  # O = Occupied
-        
+
         db.session.add(reservation)
         db.session.commit()
-        
-        flash(f'Great! You\'ve booked spot {available_spot.spot_number} at {lot.prime_location_name}!', 'success')
-    except Exception as e:
+        cache.delete_memoized(get_admin_stats)
+
+        flash(f'Great! You\'ve booked spot {claimed_spot.spot_number} at {lot.prime_location_name}!', 'success')
+    except Exception:
         db.session.rollback()
-        print(f"Booking error: {e}")  # For debugging
+        logger.exception("Booking a spot in lot %s failed", lot_id)
         flash('Something went wrong while booking your spot. Please try again.', 'error')
     
     return redirect(url_for('user_dashboard'))
@@ -398,59 +543,99 @@ def release_spot():
         reservation.leaving_timestamp = datetime.utcnow()
         reservation.total_cost = reservation.calculate_total_cost()
         
-        # Free up the parking spot
+        # Free up the parking spot and bump the lot's availability counter
         spot = ParkingSpot.query.get(reservation.spot_id)
         if spot:
-            spot.status = 'A'  # A = Available
-        
+            spot.status = ParkingSpot.AVAILABLE
+            ParkingLot.query.filter_by(id=spot.lot_id).update(
+                {'available_count': ParkingLot.available_count + 1}
+            )
+
         db.session.commit()
-        
+        cache.delete_memoized(get_admin_stats)
+
         spot_name = spot.spot_number if spot else 'your spot'
         flash(f'Successfully released {spot_name}. Total cost: ${reservation.total_cost:.2f}', 'success')
-    except Exception as e:
+    except Exception:
         db.session.rollback()
-        print(f"Release error: {e}")  # For debugging
+        logger.exception("Releasing the spot for user %s failed", current_user.id)
         flash('Something went wrong while releasing your spot. Please try again.', 'error')
     
     return redirect(url_for('user_dashboard'))
 
+# How many completed bookings the earnings report shows per page
+EARNINGS_PAGE_SIZE = 50
+
 @app.route('/admin/earnings')
 @login_required
+@admin_required
 def admin_earnings():
     """Detailed earnings report for administrators"""
-    if current_user.role != 'admin':
-        flash('Only administrators can view earnings reports.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
-    # Get all completed reservations (where people have left)
-    completed_reservations = ParkingReservation.query.filter(
-        ParkingReservation.leaving_timestamp.isnot(None)
-    ).order_by(ParkingReservation.leaving_timestamp.desc()).all()
-    
-    # Calculate total earnings
-    total_earnings = sum(reservation.total_cost or 0 for reservation in completed_reservations)
-    
-    # Break down earnings by parking lot
-    lot_earnings = {}
-    for reservation in completed_reservations:
-        lot_name = reservation.spot.lot.prime_location_name
-        if lot_name not in lot_earnings:
-            lot_earnings[lot_name] = 0
-        lot_earnings[lot_name] += reservation.total_cost or 0
-    
-    return render_template('admin_earnings.html', 
+    # Keyset pagination: ?before=<timestamp> continues from where the
+    # previous page ended, so the report stays fast no matter how much
+    # history accumulates
+    before = None
+    before_arg = request.args.get('before')
+    if before_arg:
+        try:
+            before = datetime.fromisoformat(before_arg)
+        except ValueError:
+            pass
+
+    # Get a page of completed reservations (where people have left),
+    # eager loading the spot, lot and user so the template doesn't fire
+    # a query per row
+    completed_query = ParkingReservation.query.options(
+        joinedload(ParkingReservation.spot).joinedload(ParkingSpot.lot),
+        joinedload(ParkingReservation.user)
+    ).filter(ParkingReservation.leaving_timestamp.isnot(None))
+    if before:
+        completed_query = completed_query.filter(ParkingReservation.leaving_timestamp < before)
+    completed_reservations = completed_query.order_by(
+        ParkingReservation.leaving_timestamp.desc()
+    ).limit(EARNINGS_PAGE_SIZE).all()
+
+    # Cursor for the next page, if this one came back full
+    next_before = None
+    if len(completed_reservations) == EARNINGS_PAGE_SIZE:
+        next_before = completed_reservations[-1].leaving_timestamp.isoformat()
+
+    # Whole-history summary numbers, totalled by the database
+    total_earnings = db.session.query(
+        func.coalesce(func.sum(ParkingReservation.total_cost), 0)
+    ).filter(ParkingReservation.leaving_timestamp.isnot(None)).scalar()
+    total_bookings, total_hours = db.session.query(
+        func.count(ParkingReservation.id),
+        func.coalesce(func.sum(
+            (func.julianday(ParkingReservation.leaving_timestamp) -
+             func.julianday(ParkingReservation.parking_timestamp)) * 24
+        ), 0)
+    ).filter(ParkingReservation.leaving_timestamp.isnot(None)).one()
+
+    # Break down earnings by parking lot with a single grouped query
+    lot_earnings = dict(
+        db.session.query(
+            ParkingLot.prime_location_name,
+            func.coalesce(func.sum(ParkingReservation.total_cost), 0)
+        ).join(ParkingSpot, ParkingSpot.lot_id == ParkingLot.id)
+        .join(ParkingReservation, ParkingReservation.spot_id == ParkingSpot.id)
+        .filter(ParkingReservation.leaving_timestamp.isnot(None))
+        .group_by(ParkingLot.id).all()
+    )
+    
+    return render_template('admin_earnings.html',
                          completed_reservations=completed_reservations,
+                         next_before=next_before,
                          total_earnings=total_earnings,
+                         total_bookings=total_bookings,
+                         total_hours=total_hours,
                          lot_earnings=lot_earnings)
 
 @app.route('/admin/users')
 @login_required
+@admin_required
 def view_users():
     """View all registered users"""
-    if current_user.role != 'admin':
-        flash('Only administrators can view user information.', 'error')
-        return redirect(url_for('user_dashboard'))
-    
     # Get all regular users (not admins) ordered by ID
     users = User.query.filter_by(role='user').order_by(User.id).all()
     return render_template('view_users.html', users=users)
@@ -1,21 +1,40 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from flask import g
 from datetime import datetime
 
 # Initialize our database
 db = SQLAlchemy()
 
+def _request_now():
+    """Get the current UTC time, computed once per request.
+
+    Pages like the earnings report read duration_hours for many rows;
+    stamping the time on flask.g keeps all of them consistent and
+    avoids a utcnow() call per row. Falls back to a direct call when
+    there's no request context (e.g. in a shell session).
+    """
+    try:
+        if 'request_now' not in g:
+            g.request_now = datetime.utcnow()
+        return g.request_now
+    except RuntimeError:
+        return datetime.utcnow()
+
 class User(db.Model, UserMixin):
     """
     Represents a user in our parking system.
     Can be either a regular user or an admin.
     """
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
+    username = db.Column(db.String(100), unique=True, nullable=False, index=True)
     password = db.Column(db.String(200), nullable=False)  # This will be hashed
-    role = db.Column(db.String(20), nullable=False, default='user')  # 'user' or 'admin'
+    role = db.Column(db.String(20), nullable=False, default='user', index=True)  # 'user' or 'admin'
     registration_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Relationship - this user's reservations over time
+    reservations = db.relationship('ParkingReservation', back_populates='user', lazy='select')
+
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -30,10 +49,15 @@ class ParkingLot(db.Model):
     address = db.Column(db.Text, nullable=False)
     pin_code = db.Column(db.String(10), nullable=False)
     maximum_number_of_spots = db.Column(db.Integer, nullable=False)
+    # Denormalized count of spots with status 'A', kept in sync by the
+    # booking/release views so dashboards read one row instead of
+    # counting the spots table
+    available_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship - this lot has many spots
-    spots = db.relationship('ParkingSpot', backref='lot', lazy=True, cascade='all, delete-orphan')
+    spots = db.relationship('ParkingSpot', back_populates='lot', lazy='select',
+                            cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<ParkingLot {self.prime_location_name}>'
@@ -41,37 +65,49 @@ class ParkingLot(db.Model):
     @property
     def available_spots_count(self):
         """Count how many spots are currently available"""
-        return len([spot for spot in self.spots if spot.status == 'A'])
-    
+        return self.available_count
+
     @property
     def occupied_spots_count(self):
         """Count how many spots are currently occupied"""
-        return len([spot for spot in self.spots if spot.status == 'O'])
+        return self.maximum_number_of_spots - self.available_count
+
+    @classmethod
+    def available_spot_counts(cls):
+        """Get available-spot counts for every lot in a single query.
+
+        Returns a dict of {lot_id: available count} read straight off
+        the denormalized counter column.
+        """
+        return dict(db.session.query(cls.id, cls.available_count).all())
 
 class ParkingSpot(db.Model):
     """
     Represents an individual parking spot within a parking lot.
     Can be either available or occupied.
     """
+    # Status flag values
+    AVAILABLE = 'A'
+    OCCUPIED = 'O'
+
     id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
     spot_number = db.Column(db.String(20), nullable=False)  # Like "MAL-001"
-    status = db.Column(db.String(1), default='A')  # 'A' = Available, 'O' = Occupied
+    status = db.Column(db.String(1), default=AVAILABLE, index=True)  # 'A' = Available, 'O' = Occupied
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Composite index for the "first available spot in this lot" lookup
+    __table_args__ = (
+        db.Index('ix_spot_lot_status', 'lot_id', 'status'),
+    )
     
-    # Relationship - this spot can have many reservations over time
-    reservations = db.relationship('ParkingReservation', backref='spot', lazy=True)
+    # Relationships - the lot this spot belongs to, and the spot's
+    # reservations over time
+    lot = db.relationship('ParkingLot', back_populates='spots')
+    reservations = db.relationship('ParkingReservation', back_populates='spot', lazy='select')
 
     def __repr__(self):
         return f'<ParkingSpot {self.spot_number}>'
-    
-    @property
-    def current_reservation(self):
-        """Get the current active reservation for this spot (if any)"""
-        return ParkingReservation.query.filter_by(
-            spot_id=self.id, 
-            leaving_timestamp=None
-        ).first()
 
 class ParkingReservation(db.Model):
     """
@@ -85,9 +121,16 @@ class ParkingReservation(db.Model):
     leaving_timestamp = db.Column(db.DateTime, nullable=True)  # When they left (null if still parked)
     parking_cost_per_unit_time = db.Column(db.Float, nullable=False)  # Rate per hour
     total_cost = db.Column(db.Float, nullable=True)  # Final cost (calculated when they leave)
-    
+
+    # Indexes for the active-reservation lookup and the completed-bookings filters
+    __table_args__ = (
+        db.Index('ix_res_user_leaving', 'user_id', 'leaving_timestamp'),
+        db.Index('ix_res_leaving', 'leaving_timestamp'),
+    )
+
     # Relationships
-    user = db.relationship('User', backref=db.backref('reservations', lazy=True))
+    spot = db.relationship('ParkingSpot', back_populates='reservations')
+    user = db.relationship('User', back_populates='reservations')
 
     def __repr__(self):
         return f'<ParkingReservation {self.id}>'
@@ -101,7 +144,7 @@ class ParkingReservation(db.Model):
             return duration.total_seconds() / 3600
         else:
             # They're still parked - calculate current duration
-            duration = datetime.utcnow() - self.parking_timestamp
+            duration = _request_now() - self.parking_timestamp
             return duration.total_seconds() / 3600
     
     def calculate_total_cost(self):